@@ -1,14 +1,42 @@
-import os
-import profile
+import functools
+import json
 import re
 import typing
+from urllib.parse import urlsplit
 
-import instaloader
-import pydantic
 import requests
+from requests.adapters import HTTPAdapter
 
+try:
+    import orjson
 
-class Response(pydantic.BaseModel):
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+if typing.TYPE_CHECKING:
+    import instaloader
+
+_SHORTCODE_RE = re.compile(r"instagram\.com/(?:p|reel)/([^/?]+)")
+_SHORTCODE_GRAPHQL_RE = re.compile(r"shortcode%22%3A%22([^%]+)%22")
+_GRAPHQL_URL_RE = re.compile(r"(https://[^\"'\s]+graphql/query[^\"'\s]+)")
+
+_POST_SEGMENTS = frozenset({"p", "reel"})
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# Shared session so GraphQL requests reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=1)
+)
+_SESSION.headers.update({"User-Agent": USER_AGENT})
+
+# (connect, read) timeouts: fail fast on dead hosts, allow slow reads
+TIMEOUT = (3, 30)
+
+
+class Response(typing.NamedTuple):
     preview: str
     type: typing.Literal["image", "video"]
     url: str
@@ -16,8 +44,12 @@ class Response(pydantic.BaseModel):
     height: int
 
 
+@functools.lru_cache(maxsize=1)
 def initialize_loader():
-    """Initialize and return an Instaloader instance"""
+    """Initialize and return the shared Instaloader instance"""
+    # Imported lazily so Streamlit reruns don't pay for loading instaloader
+    import instaloader
+
     return instaloader.Instaloader()
 
 
@@ -29,26 +61,18 @@ def parse_url(url):
 def extract_shortcode(url):
     """Extract shortcode from post/reel URL or GraphQL URL"""
     # Try regular post/reel URL format
-    match = re.search(r"instagram.com/(?:p|reel)/([^/?]+)", url)
+    match = _SHORTCODE_RE.search(url)
     if match:
         return match.group(1)
 
     # Try GraphQL URL format
-    match = re.search(r"shortcode%22%3A%22([^%]+)%22", url)
+    match = _SHORTCODE_GRAPHQL_RE.search(url)
     if match:
         return match.group(1)
 
     raise ValueError("Could not extract shortcode from URL")
 
 
-def extract_username(url):
-    """Extract username from URL"""
-    match = re.search(r"instagram.com/(?:stories/)?([^/?]+)", url)
-    if not match:
-        raise ValueError("Could not extract username from URL")
-    return match.group(1)
-
-
 # Post / Reel
 
 
@@ -58,8 +82,16 @@ def _extract_responses_from_node(node):
     display_resources = node.get("display_resources", [])
 
     if display_resources:
-        preview = min(display_resources, key=lambda x: x["config_height"])["src"]
-        highest_res = max(display_resources, key=lambda x: x["config_height"])
+        # Find the smallest and largest renditions in a single pass
+        lowest_res = highest_res = display_resources[0]
+        for resource in display_resources:
+            height = resource["config_height"]
+            if height < lowest_res["config_height"]:
+                lowest_res = resource
+            if height > highest_res["config_height"]:
+                highest_res = resource
+
+        preview = lowest_res["src"]
         url = node.get("video_url", highest_res["src"])
         media_type = "video" if node.get("is_video") else "image"
 
@@ -96,25 +128,16 @@ def _process_post_data(post_data, shortcode):
     }
 
 
-def _fetch_via_graphql(url, error_str):
+def _fetch_via_graphql(error_str, shortcode):
     """Attempt to fetch post data via GraphQL API"""
-    graphql_url_match = re.search(
-        r"(https://[^\"'\s]+graphql/query[^\"'\s]+)", error_str
-    )
+    graphql_url_match = _GRAPHQL_URL_RE.search(error_str)
     if not graphql_url_match:
         return None
 
     graphql_url = graphql_url_match.group(1)
-    shortcode = extract_shortcode(url)
 
-    session = requests.Session()
-    session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-    )
-    response = session.get(graphql_url)
-    data = response.json()
+    response = _SESSION.get(graphql_url, timeout=TIMEOUT)
+    data = _json_loads(response.content)
 
     if not "data" in data:
         return None
@@ -133,26 +156,36 @@ def _fetch_via_graphql(url, error_str):
 
 def download_post_or_reel(loader, url):
     """Download Instagram post or reel"""
+    import instaloader
+
     try:
         shortcode = extract_shortcode(url)
+    except ValueError as e:
+        return {
+            "status": "error",
+            "message": str(e),
+            "data": [],
+        }
+
+    try:
         main_post = instaloader.Post.from_shortcode(loader.context, shortcode)
 
-        return _process_post_data(main_post.__dict__["_node"], shortcode)
+        return _process_post_data(main_post._node, shortcode)
 
     except Exception as e:
         error_str = str(e)
-        if re.search(r"(https://[^\"'\s]+graphql/query[^\"'\s]+)", error_str):
-            try:
-                result = _fetch_via_graphql(url, error_str)
-                if result:
-                    return result
-
-            except Exception as inner_e:
-                return {
-                    "status": "error",
-                    "message": f"Failed GraphQL fallback: {str(inner_e)}",
-                    "data": [],
-                }
+        # _fetch_via_graphql returns None when the error carries no GraphQL URL
+        try:
+            result = _fetch_via_graphql(error_str, shortcode)
+            if result:
+                return result
+
+        except Exception as inner_e:
+            return {
+                "status": "error",
+                "message": f"Failed GraphQL fallback: {str(inner_e)}",
+                "data": [],
+            }
 
         return {
             "status": "error",
@@ -164,78 +197,55 @@ def download_post_or_reel(loader, url):
 # Stories
 
 
-def download_stories(loader: instaloader.Instaloader, url):
+def download_stories(url):
     """Download Instagram stories"""
-    try:
-        raise Exception("Stories download is not supported")
-
-        username = extract_username(url)
-        profile = instaloader.Profile.from_username(loader.context, username)
-        stories = loader.get_stories(userids=[profile.userid])
-
-        return {
-            "status": "success",
-            "message": f"Downloaded stories for {username}",
-            "data": [],
-        }
-
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": str(e),
-            "data": [],
-        }
+    return {
+        "status": "error",
+        "message": "Stories download is not supported",
+        "data": [],
+    }
 
 
 # Profile
 
 
-def download_profile(loader, url):
+def download_profile(url):
     """Download Instagram profile"""
-    try:
-        raise Exception("Profile download is not supported")
+    return {
+        "status": "error",
+        "message": "Profile download is not supported",
+        "data": [],
+    }
 
-        username = extract_username(url)
-        profile = instaloader.Profile.from_username(loader.context, username)
-        loader.download_profile(profile, profile_pic_only=False)
 
-        return {
-            "status": "success",
-            "message": f"Downloaded profile {username}",
-            "data": [],
-        }
+def download_instagram_content(url) -> dict[str, typing.Union[str, list[Response]]]:
+    # Split once and dispatch on the first path segment
+    parts = urlsplit(url if "://" in url else f"https://{url}")
+    host = parts.hostname or ""
+    first = parts.path.strip("/").split("/", 2)[0]
 
-    except Exception as e:
+    if not first or not (host == "instagram.com" or host.endswith(".instagram.com")):
         return {
             "status": "error",
-            "message": str(e),
+            "message": "Unsupported URL format",
             "data": [],
         }
 
+    parsed_url = f"https://instagram.com{parts.path}"
+
+    # Stories and profiles are unsupported and never touch the loader
+    if first == "stories":
+        return download_stories(parsed_url)
+
+    if first not in _POST_SEGMENTS:
+        return download_profile(parsed_url)
 
-def download_instagram_content(url) -> dict[str, typing.Union[str, list[Response]]]:
     # Initialize instaloader
-    loader: instaloader.Instaloader = initialize_loader()
+    loader: "instaloader.Instaloader" = initialize_loader()
 
     # Optional: Login (needed for stories and private content)
     # loader.login("username", "password")
 
-    parsed_url = parse_url(url)
-
-    if "instagram.com/p/" in url or "instagram.com/reel/" in url:
-        result = download_post_or_reel(loader, parsed_url)
-
-    elif "instagram.com/stories/" in parsed_url:
-        result = download_stories(loader, parsed_url)
-
-    elif re.search(r"instagram.com/([^/?]+)", parsed_url):
-        result = download_profile(loader, parsed_url)
-
-    else:
-        return {
-            "status": "error",
-            "message": "Unsupported URL format",
-            "data": [],
-        }
+    result = download_post_or_reel(loader, parsed_url)
 
     return result
@@ -1,26 +1,45 @@
-import io
 import os
+import shutil
 import time
 import typing
-from concurrent.futures import ThreadPoolExecutor
-from io import BytesIO
-from pathlib import Path
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pydantic
 import requests
 import streamlit as st
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 import instagram
 
-
-class Response(pydantic.BaseModel):
-    preview: str
-    type: typing.Literal["image", "video"]
-    url: str
-    width: int
-    height: int
+_MAX_DOWNLOAD_WORKERS = 10
+
+# File extension and MIME type for each media type
+_EXTENSIONS = {"image": "jpg", "video": "mp4"}
+_MIME_TYPES = {"image": "image/jpeg", "video": "video/mp4"}
+
+@st.cache_resource
+def _create_session():
+    # Streamlit re-executes this script on every rerun, so the session is
+    # cached as a resource to keep its pooled keep-alive connections alive;
+    # the pool is sized so every download worker can hold its own CDN socket
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=_MAX_DOWNLOAD_WORKERS,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+            ),
+        ),
+    )
+    session.headers.update({"User-Agent": instagram.USER_AGENT})
+    return session
+
+
+_SESSION = _create_session()
 
 
 def get_downloads_dir():
@@ -41,119 +60,171 @@ def get_downloads_dir():
         return os.path.join(os.path.expanduser("~"), "Downloads")
 
 
-def download_file(url, filename, save_dir=None):
-    try:
-        # Use default downloads directory if none specified
-        if save_dir is None:
-            save_dir = get_downloads_dir()
+# Resolve the downloads directory once per Streamlit session, since the mobile
+# check only depends on session state
+if "downloads_dir" not in st.session_state:
+    st.session_state.downloads_dir = get_downloads_dir()
 
-        # Create directory if it doesn't exist
-        os.makedirs(save_dir, exist_ok=True)
+DOWNLOADS_DIR = st.session_state.downloads_dir
 
-        # Full path to save the file
-        save_path = os.path.join(save_dir, filename)
 
-        # Download the file
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()  # Raise exception for 4XX/5XX responses
+def download_file(url, filename, save_dir=DOWNLOADS_DIR, timeout=instagram.TIMEOUT):
+    # Create directory if it doesn't exist
+    os.makedirs(save_dir, exist_ok=True)
 
-        # Write file
-        with open(save_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
+    # Full path to save the file
+    save_path = os.path.join(save_dir, filename)
 
-        return save_path
+    # Download the file; media is already compressed, so skip gzip
+    with _SESSION.get(
+        url,
+        stream=True,
+        timeout=timeout,
+        headers={"Accept-Encoding": "identity"},
+    ) as response:
+        # Raise on 4XX/5XX before reading any of the body or opening the file
+        response.raise_for_status()
 
-    except Exception as e:
-        return f"Error downloading {url}: {str(e)}"
+        # Write file, letting shutil copy straight from the socket in 1 MiB blocks
+        response.raw.decode_content = True
+        with open(save_path, "wb") as file:
+            shutil.copyfileobj(response.raw, file, length=1 << 20)
+
+    return save_path
 
 
 def download_multiple_files(files_data):
-    results = []
-    downloads_dir = get_downloads_dir()
+    # (file_info, saved_path) for successes, (file_info, exception) for failures
+    downloaded = []
+    failed = []
 
     # Use ThreadPoolExecutor for concurrent downloads
-    with ThreadPoolExecutor(max_workers=5) as executor:
+    # Don't start more workers than there are files, or than the pool can serve
+    max_workers = max(1, min(_MAX_DOWNLOAD_WORKERS, len(files_data)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # Submit all download tasks
         future_to_file = {
             executor.submit(
-                download_file, file_info["url"], file_info["filename"], downloads_dir
+                download_file, file_info["url"], file_info["filename"], DOWNLOADS_DIR
             ): file_info
             for file_info in files_data
         }
 
         # Process results as they complete
-        for future in future_to_file:
+        for future in as_completed(future_to_file):
             file_info = future_to_file[future]
             try:
-                result = future.result()
-                results.append(result)
-                print(f"Downloaded: {result}")
+                save_path = future.result()
+                downloaded.append((file_info, save_path))
+                print(f"Downloaded: {save_path}")
             except Exception as exc:
-                results.append(f"Error downloading {file_info['url']}: {str(exc)}")
+                failed.append((file_info, exc))
                 print(f"Error downloading {file_info['url']}: {str(exc)}")
 
-    return results
+    return downloaded, failed
 
 
-def process_input(url):
+class _FetchError(Exception):
+    pass
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch(url):
     response = instagram.download_instagram_content(url)
 
+    # Raise so st.cache_data doesn't keep transient failures around
     if response["status"] == "error":
-        st.error(response["message"])
+        raise _FetchError(response["message"])
+
+    return response
+
+
+def process_input(url):
+    # Cache on the normalized URL so query-string variants share one fetch
+    try:
+        response = _fetch(instagram.parse_url(url))
+    except _FetchError as e:
+        st.error(str(e))
         return
 
     # Store the response data in session state
     st.session_state.processed_data = response
+    st.session_state.last_url = url
     display_posts()
 
 
+def _fetch_content(url):
+    response = _SESSION.get(url, timeout=instagram.TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+# Previews are small, so keep plenty of them around for an hour
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_preview(url):
+    return _fetch_content(url)
+
+
 def display_posts():
     if st.session_state.processed_data is None:
         return
 
     response = st.session_state.processed_data
-    posts: typing.List[Response] = response["data"]  # type: ignore
+    posts: typing.List[instagram.Response] = response["data"]  # type: ignore
+
+    # Fetch all previews concurrently before rendering; full files are only
+    # fetched once the user asks for them
+    with ThreadPoolExecutor(max_workers=_MAX_DOWNLOAD_WORKERS) as executor:
+        preview_futures = [
+            executor.submit(_fetch_preview, post.preview) for post in posts
+        ]
+
+    # One timestamp per render; the index keeps filenames unique within it
+    timestamp = int(time.time())
+    username = response["username"]
 
     for idx, post in enumerate(posts):
         with st.container():
             # Display preview image
             try:
-                preview_image = requests.get(post.preview)
-                preview_image = Image.open(BytesIO(preview_image.content))
-                st.image(preview_image)
+                st.image(preview_futures[idx].result())
             except Exception as e:
                 st.error(f"Failed to load preview: {str(e)}")
 
             # Generate unique filename
-            file_name = f"{response['username']}_{int(time.time())}_{idx}"
-            file_extension = "jpg" if post.type == "image" else "mp4"
-            full_filename = f"{file_name}.{file_extension}"
-
-            # Get file content for download button
-            try:
-                file_response = requests.get(post.url)
-                file_response.raise_for_status()
-                file_content = file_response.content
-
-                # Create download button for each file
-                mime_type = "image/jpeg" if post.type == "image" else "video/mp4"
+            full_filename = f"{username}_{timestamp}_{idx}.{_EXTENSIONS[post.type]}"
+
+            # Fetch the file only on demand and keep its bytes with the
+            # session's selection, which is cleared on a new submit
+            if post.url not in st.session_state.selected_files:
+                if st.button(
+                    f"Prepare {post.type} download", key=f"prepare_{post.url}_{idx}"
+                ):
+                    try:
+                        st.session_state.selected_files[post.url] = {
+                            "url": post.url,
+                            "filename": full_filename,
+                            "content": _fetch_content(post.url),
+                        }
+                    except Exception as e:
+                        st.error(f"Failed to prepare download: {str(e)}")
+
+            # Create download button for each prepared file
+            if post.url in st.session_state.selected_files:
                 st.download_button(
                     label=f"Download {post.type}",
-                    data=file_content,
+                    data=st.session_state.selected_files[post.url]["content"],
                     file_name=full_filename,
-                    mime=mime_type,
+                    mime=_MIME_TYPES[post.type],
                     key=f"download_{post.url}_{idx}",
                 )
-            except Exception as e:
-                st.error(f"Failed to prepare download: {str(e)}")
 
             st.divider()
 
 
-# Initialize session state to store selected files
+# Initialize session state to store selected files, keyed by media URL
 if "selected_files" not in st.session_state:
-    st.session_state.selected_files = []
+    st.session_state.selected_files = {}
 
 if "processed_data" not in st.session_state:
     st.session_state.processed_data = None
@@ -173,8 +244,16 @@ if st.button("Submit"):
         st.error("Please enter a URL")
         st.stop()
 
+    # Re-submitting the URL already shown keeps its posts and selections
+    if (
+        st.session_state.get("last_url") == input_text
+        and st.session_state.processed_data
+    ):
+        display_posts()
+        st.stop()
+
     # Clear previous selections when submitting a new URL
-    st.session_state.selected_files = []
+    st.session_state.selected_files = {}
     process_input(input_text)
 else:
     # Display posts if we have processed data but didn't just submit